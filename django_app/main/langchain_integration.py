@@ -26,7 +26,8 @@ def import_langchain_components():
     try:
         # Try to import the enhanced story chain
         from chains.story_chain import create_enhanced_story_chain
-        from utils.error_handler import StorySmithError, log_error, log_info
+        from utils.error_handler import StorySmithError, configure_logging, log_error, log_info
+        configure_logging()
         return create_enhanced_story_chain, StorySmithError, log_error, log_info
     except ImportError as e:
         logger.error(f"Failed to import LangChain components: {e}")
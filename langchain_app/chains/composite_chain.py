@@ -5,6 +5,7 @@ Demonstrates LangChain's latest Runnable interface and chain composition
 
 import os
 import sys
+import asyncio
 from typing import Dict, Any
 
 # Add parent directory to path for imports
@@ -15,7 +16,6 @@ from langchain_core.runnables.utils import Input, Output
 
 from chains.story_chain import create_story_chain
 from chains.image_prompt_chain import create_image_prompt_chain
-from utils.image_merge import create_story_visualization
 from utils.error_handler import log_info, log_error
 from config import OUTPUT_DIR
 
@@ -31,7 +31,7 @@ class StoryVisualizationChain(Runnable):
         self.story_chain = create_story_chain()
         self.prompt_chain = create_image_prompt_chain()
     
-    def invoke(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    def invoke(self, input_data: Dict[str, Any], config=None, **kwargs) -> Dict[str, Any]:
         """Complete story visualization pipeline using modern LangChain composition"""
         try:
             topic = input_data.get("topic", "")
@@ -46,7 +46,8 @@ class StoryVisualizationChain(Runnable):
             image_prompts = prompt_result["image_prompts"]
             
             # Step 3: Image Generation (not part of LangChain, but integrated)
-            story_title = topic.replace(" ", "_").lower()
+            from utils.image_merge import create_story_visualization, slugify_topic
+            story_title = slugify_topic(topic)
             final_image_path = create_story_visualization(
                 image_prompts["character_prompt"],
                 image_prompts["background_prompt"],
@@ -54,16 +55,7 @@ class StoryVisualizationChain(Runnable):
             )
             
             # Combine all results
-            complete_result = {
-                "topic": topic,
-                "story": story_data["story"],
-                "character_description": story_data["character_description"],
-                "background_description": story_data["background_description"],
-                "character_prompt": image_prompts["character_prompt"],
-                "background_prompt": image_prompts["background_prompt"],
-                "detected_style": image_prompts["detected_style"],
-                "final_image_path": final_image_path
-            }
+            complete_result = self._complete_result(topic, story_data, image_prompts, final_image_path)
             
             log_info("Complete story visualization pipeline completed successfully!")
             return complete_result
@@ -73,7 +65,7 @@ class StoryVisualizationChain(Runnable):
             log_error(error_msg)
             raise Exception(error_msg)
     
-    def stream(self, input_data: Dict[str, Any]):
+    def stream(self, input_data: Dict[str, Any], config=None, **kwargs):
         """Stream intermediate results for real-time updates"""
         topic = input_data.get("topic", "")
         
@@ -93,7 +85,8 @@ class StoryVisualizationChain(Runnable):
             
             # Yield image generation progress
             yield {"step": "image_generation", "status": "starting"}
-            story_title = topic.replace(" ", "_").lower()
+            from utils.image_merge import create_story_visualization, slugify_topic
+            story_title = slugify_topic(topic)
             final_image_path = create_story_visualization(
                 image_prompts["character_prompt"],
                 image_prompts["background_prompt"],
@@ -102,21 +95,36 @@ class StoryVisualizationChain(Runnable):
             yield {"step": "image_generation", "status": "completed", "image_path": final_image_path}
             
             # Final result
-            complete_result = {
-                "topic": topic,
-                "story": story_data["story"],
-                "character_description": story_data["character_description"],
-                "background_description": story_data["background_description"],
-                "character_prompt": image_prompts["character_prompt"],
-                "background_prompt": image_prompts["background_prompt"],
-                "detected_style": image_prompts["detected_style"],
-                "final_image_path": final_image_path
-            }
+            complete_result = self._complete_result(topic, story_data, image_prompts, final_image_path)
             
             yield {"step": "complete", "status": "success", "result": complete_result}
             
         except Exception as e:
             yield {"step": "error", "status": "failed", "error": str(e)}
+    
+    async def astream(self, input_data: Dict[str, Any], config=None, **kwargs):
+        """Async variant of stream - each blocking step runs in a worker thread"""
+        steps = self.stream(input_data, config, **kwargs)
+        while True:
+            chunk = await asyncio.to_thread(next, steps, None)
+            if chunk is None:
+                break
+            yield chunk
+    
+    @staticmethod
+    def _complete_result(topic: str, story_data: Dict[str, Any], image_prompts: Dict[str, Any],
+                         final_image_path: str) -> Dict[str, Any]:
+        """Final result shared by invoke and stream"""
+        return {
+            "topic": topic,
+            "story": story_data["story"],
+            "character_description": story_data["character_description"],
+            "background_description": story_data["background_description"],
+            "character_prompt": image_prompts["character_prompt"],
+            "background_prompt": image_prompts["background_prompt"],
+            "detected_style": image_prompts["detected_style"],
+            "final_image_path": final_image_path
+        }
 
 
 def create_story_visualization_chain() -> StoryVisualizationChain:
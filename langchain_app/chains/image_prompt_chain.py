@@ -5,6 +5,7 @@ Image Prompt Chain - Converts story descriptions to optimized image generation p
 import os
 import sys
 import re
+import functools
 import logging
 from typing import Dict, Any, List
 
@@ -25,13 +26,22 @@ from utils.error_handler import log_error, log_warning
 logger = logging.getLogger(__name__)
 
 
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize_text(text: str) -> str:
+    """Collapse whitespace so cosmetic differences share a cache entry"""
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
 class ImagePromptChain(Runnable):
     """Modern LangChain Runnable for converting character and background descriptions to image prompts"""
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
     
-    def _detect_style(self, story_text: str) -> str:
+    @staticmethod
+    def _detect_style(story_text: str) -> str:
         """Detect the style/genre of the story to apply appropriate modifiers"""
         story_lower = story_text.lower()
         
@@ -57,7 +67,8 @@ class ImagePromptChain(Runnable):
             return max(genre_scores, key=genre_scores.get)
         return "default"
     
-    def _clean_description(self, description: str) -> str:
+    @staticmethod
+    def _clean_description(description: str) -> str:
         """Clean and optimize description for image generation"""
         # Remove common filler words and phrases that don't help image generation
         filler_phrases = [
@@ -78,9 +89,10 @@ class ImagePromptChain(Runnable):
         
         return cleaned
     
-    def _enhance_character_prompt(self, character_desc: str, style: str) -> str:
+    @staticmethod
+    def _enhance_character_prompt(character_desc: str, style: str) -> str:
         """Create optimized character prompt for image generation"""
-        cleaned_desc = self._clean_description(character_desc)
+        cleaned_desc = ImagePromptChain._clean_description(character_desc)
         style_modifier = STYLE_MODIFIERS.get(style, STYLE_MODIFIERS["default"])
         
         # Add specific instructions for better character generation
@@ -91,9 +103,10 @@ class ImagePromptChain(Runnable):
         
         return enhanced_prompt
     
-    def _enhance_background_prompt(self, background_desc: str, style: str) -> str:
+    @staticmethod
+    def _enhance_background_prompt(background_desc: str, style: str) -> str:
         """Create optimized background prompt for image generation"""
-        cleaned_desc = self._clean_description(background_desc)
+        cleaned_desc = ImagePromptChain._clean_description(background_desc)
         style_modifier = STYLE_MODIFIERS.get(style, STYLE_MODIFIERS["default"])
         
         # Add specific instructions for better background generation
@@ -104,7 +117,7 @@ class ImagePromptChain(Runnable):
         
         return enhanced_prompt
     
-    def invoke(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    def invoke(self, input_data: Dict[str, Any], config=None, **kwargs) -> Dict[str, Any]:
         """Modern LangChain invoke method for Runnable interface"""
         try:
             story_data = input_data.get("story_data", {})
@@ -127,21 +140,16 @@ class ImagePromptChain(Runnable):
             
             logger.info("Generating optimized image prompts...")
             
-            # Detect style from story
-            detected_style = self._detect_style(story)
-            logger.info(f"Detected style: {detected_style}")
-            
-            # Generate enhanced prompts
-            character_prompt = self._enhance_character_prompt(character_desc, detected_style)
-            background_prompt = self._enhance_background_prompt(background_desc, detected_style)
-            
-            result = {
-                "character_prompt": character_prompt,
-                "background_prompt": background_prompt,
-                "detected_style": detected_style,
-                "original_character_desc": character_desc,
-                "original_background_desc": background_desc
-            }
+            # Output is deterministic in the (whitespace-normalized) inputs, so
+            # repeated descriptions are served from the cache
+            result = dict(_build_image_prompts(
+                _normalize_text(story),
+                _normalize_text(character_desc),
+                _normalize_text(background_desc)
+            ))
+            character_prompt = result["character_prompt"]
+            background_prompt = result["background_prompt"]
+            logger.info(f"Detected style: {result['detected_style']}")
             
             logger.info("Image prompts generated successfully!")
             logger.info(f"Character prompt: {character_prompt[:100]}...")
@@ -158,6 +166,22 @@ class ImagePromptChain(Runnable):
             raise Exception(error_msg)
 
 
+@functools.lru_cache(maxsize=1024)
+def _build_image_prompts(story: str, character_desc: str, background_desc: str) -> Dict[str, str]:
+    """Build the image prompts for one story (memoized on the normalized strings)"""
+    # Detect style from story
+    detected_style = ImagePromptChain._detect_style(story)
+    
+    # Generate enhanced prompts
+    return {
+        "character_prompt": ImagePromptChain._enhance_character_prompt(character_desc, detected_style),
+        "background_prompt": ImagePromptChain._enhance_background_prompt(background_desc, detected_style),
+        "detected_style": detected_style,
+        "original_character_desc": character_desc,
+        "original_background_desc": background_desc
+    }
+
+
 def create_image_prompt_chain() -> ImagePromptChain:
     """Factory function to create an ImagePromptChain instance"""
     return ImagePromptChain()
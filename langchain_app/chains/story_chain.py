@@ -19,8 +19,8 @@ from langchain_core.runnables import Runnable
 # Import existing components
 from chains.story_chain import create_story_chain
 from chains.image_prompt_chain import create_image_prompt_chain
-from utils.image_merge import generate_image_from_prompt, merge_character_and_background
 from utils.error_handler import log_info, log_error, log_warning, StorySmithError
+from utils.timestamps import now_slug
 from config import OUTPUT_DIR
 
 # Get logger for this module
@@ -43,7 +43,7 @@ class EnhancedStoryVisualizationChain(Runnable):
         self.story_chain = create_story_chain()
         self.prompt_chain = create_image_prompt_chain()
     
-    def invoke(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    def invoke(self, input_data: Dict[str, Any], config=None, **kwargs) -> Dict[str, Any]:
         """Complete story visualization pipeline"""
         try:
             topic = input_data.get("topic", "")
@@ -64,6 +64,8 @@ class EnhancedStoryVisualizationChain(Runnable):
             
             result = {
                 "topic": topic,
+                # Callers may pass the topic as typed alongside the compressed prompt version
+                "topic_original": input_data.get("topic_original", topic),
                 "timestamp": datetime.now().isoformat(),
                 "story": story_data["story"],
                 "character_description": story_data["character_description"],
@@ -96,36 +98,35 @@ class EnhancedStoryVisualizationChain(Runnable):
             
             # Step 3: Generate Images
             logger.info("\n🖼️  Step 3: Generating images...")
+            # Imported here so story-only runs never load the image stack
+            from utils.image_merge import generate_images, save_image, merge_images, slugify_topic
             timestamp = int(time.time())
             
-            # Generate character image
-            logger.info("   📷 Generating character image...")
-            character_filename = f"character_{timestamp}.png"
-            character_path = generate_image_from_prompt(
-                image_prompts["character_prompt"], 
-                character_filename
+            # One batched diffusion run on local models; concurrent requests on the API
+            logger.info("   📷 Generating character and background images...")
+            character_image, background_image = generate_images(
+                [image_prompts["character_prompt"], image_prompts["background_prompt"]]
             )
+            
+            # The result reports the individual images, so these two are saved;
+            # the merge below works on the in-memory copies
+            character_path = save_image(character_image, f"character_{timestamp}.png")
+            background_path = save_image(background_image, f"background_{timestamp}.png")
+            
             result["character_image_path"] = character_path
             logger.info(f"   ✅ Character image: {character_path}")
             
-            # Generate background image
-            logger.info("   📷 Generating background image...")
-            background_filename = f"background_{timestamp}.png"
-            background_path = generate_image_from_prompt(
-                image_prompts["background_prompt"], 
-                background_filename
-            )
             result["background_image_path"] = background_path
             logger.info(f"   ✅ Background image: {background_path}")
             
             # Step 4: Merge Images
             logger.info("\n🔗 Step 4: Merging images...")
-            story_title = topic.replace(" ", "_").lower()[:20]  # Truncate for filename
+            story_title = slugify_topic(topic, max_length=20)  # Truncate for filename
             output_filename = f"{story_title}_{timestamp}_final.jpg"
             
-            final_image_path = merge_character_and_background(
-                character_path,
-                background_path,
+            final_image_path = merge_images(
+                character_image,
+                background_image,
                 output_filename
             )
             result["final_image_path"] = final_image_path
@@ -150,40 +151,49 @@ class EnhancedStoryVisualizationChain(Runnable):
     def _save_story_summary(self, result: Dict[str, Any]):
         """Save a comprehensive summary of the generated story and images"""
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = now_slug()
             summary_file = os.path.join(OUTPUT_DIR, f"enhanced_story_summary_{timestamp}.txt")
             
-            with open(summary_file, "w", encoding="utf-8") as f:
-                f.write("StorySmith AI - Enhanced Story Generation Summary\n")
-                f.write("=" * 60 + "\n")
-                f.write(f"Generated on: {result['timestamp']}\n")
-                f.write(f"Topic: {result['topic']}\n")
-                f.write(f"Detected Style: {result.get('detected_style', 'N/A')}\n\n")
-                
-                f.write("STORY:\n")
-                f.write("-" * 30 + "\n")
-                f.write(f"{result['story']}\n\n")
-                
-                f.write("CHARACTER DESCRIPTION:\n")
-                f.write("-" * 30 + "\n")
-                f.write(f"{result['character_description']}\n\n")
+            lines = [
+                "StorySmith AI - Enhanced Story Generation Summary\n",
+                "=" * 60 + "\n",
+                f"Generated on: {result['timestamp']}\n",
+                f"Topic: {result['topic_original']}\n",
+                f"Detected Style: {result.get('detected_style', 'N/A')}\n\n",
                 
-                f.write("BACKGROUND DESCRIPTION:\n")
-                f.write("-" * 30 + "\n")
-                f.write(f"{result['background_description']}\n\n")
+                "STORY:\n",
+                "-" * 30 + "\n",
+                f"{result['story']}\n\n",
                 
-                if result.get('character_prompt'):
-                    f.write("IMAGE PROMPTS:\n")
-                    f.write("-" * 30 + "\n")
-                    f.write(f"Character: {result['character_prompt']}\n\n")
-                    f.write(f"Background: {result['background_prompt']}\n\n")
+                "CHARACTER DESCRIPTION:\n",
+                "-" * 30 + "\n",
+                f"{result['character_description']}\n\n",
                 
-                if result.get('final_image_path'):
-                    f.write("GENERATED FILES:\n")
-                    f.write("-" * 30 + "\n")
-                    f.write(f"Character Image: {result.get('character_image_path', 'N/A')}\n")
-                    f.write(f"Background Image: {result.get('background_image_path', 'N/A')}\n")
-                    f.write(f"Final Merged Image: {result['final_image_path']}\n")
+                "BACKGROUND DESCRIPTION:\n",
+                "-" * 30 + "\n",
+                f"{result['background_description']}\n\n"
+            ]
+            
+            if result.get('character_prompt'):
+                lines += [
+                    "IMAGE PROMPTS:\n",
+                    "-" * 30 + "\n",
+                    f"Character: {result['character_prompt']}\n\n",
+                    f"Background: {result['background_prompt']}\n\n"
+                ]
+            
+            if result.get('final_image_path'):
+                lines += [
+                    "GENERATED FILES:\n",
+                    "-" * 30 + "\n",
+                    f"Character Image: {result.get('character_image_path', 'N/A')}\n",
+                    f"Background Image: {result.get('background_image_path', 'N/A')}\n",
+                    f"Final Merged Image: {result['final_image_path']}\n"
+                ]
+            
+            # Write the summary in one call instead of one write per line
+            with open(summary_file, "w", encoding="utf-8", buffering=1 << 16) as f:
+                f.writelines(lines)
             
             log_info(f"Story summary saved: {summary_file}")
             
@@ -39,20 +39,26 @@ ALTERNATIVE_IMAGE_MODELS = [
 # Local Model Paths (for local execution)
 LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "./models")
 USE_LOCAL_MODELS = os.getenv("USE_LOCAL_MODELS", "true").lower() == "true"  # Default to local execution
+USE_LCM = os.getenv("USE_LCM", "false").lower() == "true"  # LCM-LoRA: ~6 denoising steps instead of 20
 
 # Image Configuration
 IMAGE_SIZE = (1024, 1024)  # SDXL native resolution for best quality
 CHARACTER_POSITION = "center"  # Position for character placement
 BACKGROUND_REMOVE_THRESHOLD = 240  # White background removal threshold (0-255)
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2netp")  # Lightweight U²-Net for character cut-outs
+USE_LEGACY_BG_REMOVE = os.getenv("USE_LEGACY_BG_REMOVE", "false").lower() == "true"  # Force threshold-based removal
 
 # Output Configuration
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./outputs")
 TEMP_DIR = os.getenv("TEMP_DIR", "./temp")
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "./cache/images")  # Generated images keyed by prompt
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))  # Least recently used images evicted past this
 
 # API Configuration
 API_TIMEOUT = 60  # seconds
-MAX_RETRIES = 3
+MAX_RETRIES = 5
 RATE_LIMIT_WAIT = 2  # seconds between requests
+IMAGE_GENERATION_DEADLINE = 300  # seconds for a whole batch of concurrent API image requests
 
 # Story Generation Prompts - Optimized for Phi-3-mini instruction following
 STORY_PROMPT_TEMPLATE = """<|user|>
@@ -143,5 +149,6 @@ LOG_FILE = os.getenv("LOG_FILE", "storysmith.log")
 # Create necessary directories
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
 if USE_LOCAL_MODELS:
     os.makedirs(LOCAL_MODEL_PATH, exist_ok=True)
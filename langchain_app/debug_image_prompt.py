@@ -12,7 +12,7 @@ import logging
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from chains.image_prompt_chain import create_image_prompt_chain
-from utils.error_handler import log_info, log_error
+from utils.error_handler import configure_logging, log_info, log_error
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
@@ -198,4 +198,5 @@ def main():
 
 
 if __name__ == "__main__":
+    configure_logging()
     main()
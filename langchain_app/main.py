@@ -4,59 +4,166 @@ Integrates story generation with image generation in a complete LangChain pipeli
 """
 
 import os
+import re
 import sys
 import argparse
+import functools
 import logging
-from datetime import datetime
+import threading
 
 # Add current directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from langchain_app.chains.story_chain import create_enhanced_story_chain, create_simple_story_chain
-from utils.error_handler import log_info, log_error, log_warning, StorySmithError
+from utils.error_handler import configure_logging, log_info, log_error, log_warning, StorySmithError
+from utils.timestamps import now_slug
 from config import OUTPUT_DIR, USE_LOCAL_MODELS
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
+# Nothing local gets loaded, so keep transformers quiet if a dependency imports it
+if not USE_LOCAL_MODELS:
+    os.environ.setdefault("TRANSFORMERS_NO_ADVISORY_WARNINGS", "1")
 
-def display_story_result(result: dict):
-    """Display the generated story and image information in a nice format"""
-    logger.info("\n" + "="*70)
-    logger.info("🎉 STORYSMITH AI - COMPLETE STORY GENERATION 🎉")
-    logger.info("="*70)
-    
-    logger.info(f"📝 Topic: {result['topic']}")
-    logger.info(f"🕒 Generated: {result['timestamp']}")
-    if result.get('detected_style'):
-        logger.info(f"🎭 Style: {result['detected_style']}")
+
+# Result display templates - built once at import instead of on every call
+_BANNER = "=" * 70
+_SEP = "-" * 40
+
+_RESULT_HEADER = f"""
+{_BANNER}
+🎉 STORYSMITH AI - COMPLETE STORY GENERATION 🎉
+{_BANNER}
+📝 Topic: {{topic}}
+🕒 Generated: {{timestamp}}
+"""
+
+_STYLE_LINE = "🎭 Style: {detected_style}\n"
+
+_RESULT_BODY = f"""
+📖 STORY:
+{_SEP}
+{{story}}
+
+👤 CHARACTER DESCRIPTION:
+{_SEP}
+{{character_description}}
+
+🏞️ BACKGROUND DESCRIPTION:
+{_SEP}
+{{background_description}}
+"""
+
+_PROMPTS_SECTION = f"""
+🎨 IMAGE PROMPTS:
+{_SEP}
+Character: {{character_prompt}}
+Background: {{background_prompt}}
+"""
+
+_IMAGES_SECTION = f"""
+🖼️ GENERATED IMAGES:
+{_SEP}
+Character Image: {{character_image_path}}
+Background Image: {{background_image_path}}
+Final Merged Image: {{final_image_path}}
+"""
+
+
+# Articles and request boilerplate add prompt tokens without changing what the
+# story is about. Prepositions and negations carry meaning ("a city under the
+# sea", "life on Mars") and are deliberately kept.
+_TOPIC_STOP_WORDS = frozenset({
+    "a", "an", "the", "please", "write", "tell", "me", "story",
+    "can", "could", "would", "you"
+})
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Chain construction is a fixed cost - build each variant once per process.
+# The chain modules are imported on first use so `--help` and argument
+# errors don't pay for the LangChain/image stack.
+@functools.lru_cache(maxsize=4)
+def _cached_enhanced(generate_images: bool = True):
+    """Return the shared enhanced story chain"""
+    from langchain_app.chains.story_chain import create_enhanced_story_chain
+    return create_enhanced_story_chain(generate_images=generate_images)
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_simple():
+    """Return the shared story-only chain"""
+    from langchain_app.chains.story_chain import create_simple_story_chain
+    return create_simple_story_chain()
+
+
+def _prewarm_chain(story_only: bool):
+    """Build the chain this run will need while main() waits on the user"""
+    try:
+        if story_only:
+            _cached_simple()
+        else:
+            _cached_enhanced(generate_images=True)
+    except Exception as e:
+        # Not fatal - the real call rebuilds the chain and reports the error
+        logger.debug(f"Chain prewarm failed: {e}")
+
+
+class _ChainPrewarm(logging.Filter):
+    """Run _prewarm_chain in the background, holding its console output until finish()
+    so log lines never print into the middle of an input() prompt"""
     
-    logger.info("\n" + "📖 STORY:")
-    logger.info("-" * 40)
-    logger.info(result['story'])
+    def __init__(self, story_only: bool):
+        super().__init__()
+        self.records = []
+        self.thread = threading.Thread(target=_prewarm_chain, args=(story_only,),
+                                       name="chain-prewarm", daemon=True)
+        # The console handlers sit on the root logger; file logging is queued and unaffected
+        self.handlers = [h for h in logging.getLogger().handlers if isinstance(h, logging.StreamHandler)]
     
-    logger.info("\n" + "👤 CHARACTER DESCRIPTION:")
-    logger.info("-" * 40)
-    logger.info(result['character_description'])
+    def filter(self, record):
+        if record.threadName != self.thread.name:
+            return True
+        self.records.append(record)
+        return False
     
-    logger.info("\n" + "🏞️ BACKGROUND DESCRIPTION:")
-    logger.info("-" * 40)
-    logger.info(result['background_description'])
+    def start(self):
+        for handler in self.handlers:
+            handler.addFilter(self)
+        self.thread.start()
     
+    def finish(self):
+        """Wait for the build, then print what it logged"""
+        self.thread.join()
+        for handler in self.handlers:
+            handler.removeFilter(self)
+            for record in self.records:
+                handler.handle(record)
+
+
+def _compress_topic(topic: str, max_chars: int = 120) -> str:
+    """Strip filler words and extra whitespace from a topic to cut prompt tokens"""
+    normalized = _WHITESPACE_RE.sub(" ", topic.strip())
+    words = [word for word in normalized.split(" ") if word.lower() not in _TOPIC_STOP_WORDS]
+    # Topics made only of filler words are passed through as typed
+    compressed = " ".join(words) or normalized
+    if len(compressed) > max_chars:
+        compressed = compressed[:max_chars].rsplit(" ", 1)[0]
+    return compressed
+
+def display_story_result(result: dict):
+    """Display the generated story and image information in a nice format"""
+    # Fill the precompiled templates and emit the whole block with a single logging call
+    # Show the topic as the user typed it, not the compressed prompt version
+    parts = [_RESULT_HEADER.format(**{**result, "topic": result.get("topic_original", result["topic"])})]
+    if result.get('detected_style'):
+        parts.append(_STYLE_LINE.format(**result))
+    parts.append(_RESULT_BODY.format(**result))
     if result.get('character_prompt'):
-        logger.info("\n" + "🎨 IMAGE PROMPTS:")
-        logger.info("-" * 40)
-        logger.info(f"Character: {result['character_prompt']}")
-        logger.info(f"Background: {result['background_prompt']}")
-    
+        parts.append(_PROMPTS_SECTION.format(**result))
     if result.get('final_image_path'):
-        logger.info("\n" + "🖼️ GENERATED IMAGES:")
-        logger.info("-" * 40)
-        logger.info(f"Character Image: {result['character_image_path']}")
-        logger.info(f"Background Image: {result['background_image_path']}")
-        logger.info(f"Final Merged Image: {result['final_image_path']}")
-    
-    logger.info("\n" + "="*70)
+        parts.append(_IMAGES_SECTION.format(**result))
+    parts.append(f"\n{_BANNER}")
+    logger.info("".join(parts))
 
 
 def generate_story_with_images(topic: str) -> dict:
@@ -65,12 +172,10 @@ def generate_story_with_images(topic: str) -> dict:
         log_info(f"Starting complete story generation with images for: {topic}")
         
         # Create the enhanced chain
-        enhanced_chain = create_enhanced_story_chain(generate_images=True)
+        enhanced_chain = _cached_enhanced(generate_images=True)
         
         # Run the complete pipeline
-        result = enhanced_chain.invoke({"topic": topic})
-        
-        return result
+        return enhanced_chain.invoke({"topic": _compress_topic(topic), "topic_original": topic})
         
     except Exception as e:
         error_msg = f"Enhanced story generation failed: {e}"
@@ -84,12 +189,10 @@ def generate_story_only(topic: str) -> dict:
         log_info(f"Starting story-only generation for: {topic}")
         
         # Create simple chain without images
-        simple_chain = create_simple_story_chain()
+        simple_chain = _cached_simple()
         
         # Run story generation only
-        result = simple_chain.invoke({"topic": topic})
-        
-        return result
+        return simple_chain.invoke({"topic": _compress_topic(topic), "topic_original": topic})
         
     except Exception as e:
         error_msg = f"Story generation failed: {e}"
@@ -107,6 +210,7 @@ Examples:
   python enhanced_main.py "A magical adventure"           # Full generation
   python enhanced_main.py --story-only "Space adventure"  # Story only, no images
   python enhanced_main.py --test                          # Test mode
+  python enhanced_main.py --yes "A magical adventure"     # No confirmation prompt
         """
     )
     
@@ -115,9 +219,24 @@ Examples:
                        help="Generate story content only (faster, no images)")
     parser.add_argument("--test", action="store_true", 
                        help="Run test with predefined topic")
+    parser.add_argument("-y", "--yes", action="store_true",
+                       help="Run full generation without asking, even when local models are disabled")
     
     args = parser.parse_args()
     
+    # After argument parsing, so --help never opens the log file
+    configure_logging()
+    
+    # Overlap chain construction with the interactive prompts below; with no
+    # prompt to wait on, the chain is simply built when it is first used.
+    # Without local models and --yes, the confirmation defaults to story-only.
+    needs_confirmation = not USE_LOCAL_MODELS and not args.story_only and not args.yes
+    prewarm = None
+    if needs_confirmation or not (args.test or args.topic):
+        expect_story_only = args.story_only or (not USE_LOCAL_MODELS and not args.yes)
+        prewarm = _ChainPrewarm(expect_story_only)
+        prewarm.start()
+    
     try:
         # Determine topic
         if args.test:
@@ -139,9 +258,18 @@ Examples:
         # Check if image generation is available
         if not USE_LOCAL_MODELS and not args.story_only:
             log_warning("⚠️  Note: Local models disabled. Consider using --story-only for faster generation.")
-            user_choice = input("Continue with full generation? (y/n): ").strip().lower()
-            if user_choice != 'y':
-                args.story_only = True
+            if not args.yes:
+                # Piped answers still count; a closed stdin means the default (--yes overrides)
+                try:
+                    user_choice = input("Continue with full generation? (y/n): ").strip().lower()
+                except EOFError:
+                    user_choice = "n"
+                if user_choice != 'y':
+                    args.story_only = True
+        
+        # Make sure the background build is done before the chain is used
+        if prewarm is not None:
+            prewarm.finish()
         
         # Generate based on mode
         if args.story_only:
@@ -156,16 +284,18 @@ Examples:
         
         # Save summary (if not already saved by enhanced chain)
         if args.story_only:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = now_slug()
             summary_file = os.path.join(OUTPUT_DIR, f"story_only_summary_{timestamp}.txt")
             
-            with open(summary_file, "w", encoding="utf-8") as f:
-                f.write(f"StorySmith AI - Story Only Summary\n")
-                f.write(f"Generated on: {result['timestamp']}\n")
-                f.write(f"Topic: {result['topic']}\n\n")
-                f.write(f"STORY:\n{result['story']}\n\n")
-                f.write(f"CHARACTER:\n{result['character_description']}\n\n")
-                f.write(f"BACKGROUND:\n{result['background_description']}\n")
+            with open(summary_file, "w", encoding="utf-8", buffering=1 << 16) as f:
+                f.writelines([
+                    "StorySmith AI - Story Only Summary\n",
+                    f"Generated on: {result['timestamp']}\n",
+                    f"Topic: {result['topic_original']}\n\n",
+                    f"STORY:\n{result['story']}\n\n",
+                    f"CHARACTER:\n{result['character_description']}\n\n",
+                    f"BACKGROUND:\n{result['background_description']}\n"
+                ])
             
             logger.info(f"\n📄 Summary saved to: {summary_file}")
         
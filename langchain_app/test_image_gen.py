@@ -5,38 +5,219 @@ Test SDXL image generation capability
 
 import os
 import sys
+import time
+import atexit
 import logging
+import functools
+import threading
+import importlib.util
+from dataclasses import dataclass
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-try:
-    import torch
-    from diffusers import StableDiffusionXLPipeline
-except ImportError as e:
-    import logging
-    logger = logging.getLogger(__name__)
-    log_error(f"Import error: {e}")
-    log_error("Install required packages: pip install torch diffusers")
-    sys.exit(1)
+# huggingface_hub reads this once at import time (diffusers imports it), and it
+# refuses to download at all if the flag is set without hf_transfer installed
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")  # Rust parallel downloader
 
-from config import USE_LOCAL_MODELS, IMAGE_GENERATION_MODEL, IMAGE_SIZE, OUTPUT_DIR
-from utils.error_handler import log_info, log_error, log_warning
+from config import USE_LOCAL_MODELS, IMAGE_GENERATION_MODEL, IMAGE_SIZE, OUTPUT_DIR, LOCAL_MODEL_PATH
+
+# Keep compiled UNet kernels between runs; torch reads these when it is first
+# imported (lazily, below), so the max-autotune compile is only paid once
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.abspath(os.path.join(LOCAL_MODEL_PATH, "inductor_cache")))
+os.environ.setdefault("TRITON_CACHE_DIR", os.path.abspath(os.path.join(LOCAL_MODEL_PATH, "triton_cache")))
+from utils.error_handler import configure_logging, log_info, log_error, log_warning
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
-def main():
+
+@functools.lru_cache(maxsize=None)
+def _lazy(name):
+    """Import a heavy module on first use instead of at startup"""
+    return importlib.import_module(name)
+
+
+# Fixed generation shape for the test; torch.compile specialises on it
+_TEST_GENERATION_ARGS = dict(
+    width=512,
+    height=512,
+    num_inference_steps=15,  # Fast test; enough for DPM++ 2M Karras
+    guidance_scale=7.5
+)
+
+
+@dataclass(frozen=True)
+class GPUInfo:
+    """What the first CUDA device can do, queried once per process"""
+    available: bool
+    name: str
+    total_memory_gb: float
+    supports_bf16: bool
+    compute_capability: tuple
+
+
+@functools.lru_cache(maxsize=1)
+def _gpu_info():
+    """Query the CUDA driver once and cache the answer"""
+    torch = _lazy("torch")
+    if not torch.cuda.is_available():
+        return GPUInfo(False, "", 0.0, False, (0, 0))
+    props = torch.cuda.get_device_properties(0)
+    capability = torch.cuda.get_device_capability(0)
+    return GPUInfo(
+        available=True,
+        name=props.name,
+        total_memory_gb=props.total_memory / 1e9,
+        # Ampere (SM80) and newer run bf16 natively; older cards overflow in it
+        supports_bf16=capability >= (8, 0),
+        compute_capability=capability
+    )
+
+
+def _pipe_dtype():
+    """bf16 on Ampere and newer, fp16 everywhere else"""
+    torch = _lazy("torch")
+    return torch.bfloat16 if _gpu_info().supports_bf16 else torch.float16
+
+
+# Loaded pipeline, shared by every call in this process
+_PIPE = None
+_PIPE_LOCK = threading.Lock()
+
+
+def _configure_attention(pipe, vram_gb, allow_xformers=True):
+    """Pick the fastest attention that fits: xformers, else SDPA sliced only on small cards"""
+    from diffusers.utils import is_xformers_available
+    if allow_xformers and is_xformers_available():
+        # Memory-efficient and fast, so it beats slicing at every VRAM size
+        pipe.enable_xformers_memory_efficient_attention()
+    elif vram_gb < 8:
+        pipe.enable_attention_slicing("auto")
+    elif vram_gb < 12:
+        pipe.enable_attention_slicing(4)
+    # 12GB and up: a single unsliced SDPA call fits for 512x512, batch 1
+
+
+def _load_pipe():
+    """Download (if needed) and load the SDXL pipeline for this machine"""
+    from huggingface_hub import snapshot_download
+    torch = _lazy("torch")
+    StableDiffusionXLPipeline = _lazy("diffusers").StableDiffusionXLPipeline
+    
+    # Authentication is handled by the cached token from huggingface-cli login
+    logger.info("🔑 Using cached HuggingFace authentication...")
+    
+    # Load pipeline - using correct SDXL model name with better download settings
+    model_name = "stabilityai/stable-diffusion-xl-base-1.0"  # Correct model name
+    logger.info(f"Loading model: {model_name}")
+    
+    # Fetch only the fp16 weights plus configs/tokenizer files, several files
+    # at a time; already-cached files are not downloaded again
+    local_dir = snapshot_download(
+        repo_id=model_name,
+        allow_patterns=["*.fp16.safetensors", "*.json", "*.txt"],
+        max_workers=8
+    )
+    
+    gpu = _gpu_info()
+    dtype = _pipe_dtype()
+    logger.info(f"Pipeline dtype: {dtype}")
+    
+    pipe = StableDiffusionXLPipeline.from_pretrained(
+        local_dir,
+        torch_dtype=dtype,
+        use_safetensors=True,
+        variant="fp16",
+        local_files_only=True
+    )
+    
+    # DPM++ 2M with Karras sigmas converges in fewer steps than the default
+    # Euler scheduler, and every step is a full UNet pass
+    pipe.scheduler = _lazy("diffusers").DPMSolverMultistepScheduler.from_config(
+        pipe.scheduler.config,
+        algorithm_type="dpmsolver++",
+        use_karras_sigmas=True
+    )
+    
+    if gpu.available:
+        resident = gpu.total_memory_gb >= 10
+        # The resident UNet is compiled with fullgraph=True, which xformers'
+        # custom ops would break; SDPA traces cleanly
+        _configure_attention(pipe, gpu.total_memory_gb, allow_xformers=not resident)
+        
+        if resident:
+            # SDXL fits in VRAM: keep it resident instead of paying PCIe
+            # transfers for offloading
+            pipe = pipe.to("cuda", dtype, silence_dtype_warnings=True)
+            torch.backends.cudnn.benchmark = True
+            torch.set_float32_matmul_precision("high")  # TF32 on fp32 fallbacks
+            
+            # The test shape never changes, so compile the UNet specialised
+            # to it; channels_last is the layout the fused conv kernels want
+            pipe.unet.to(memory_format=torch.channels_last)
+            pipe.vae.to(memory_format=torch.channels_last)
+            pipe.unet = torch.compile(pipe.unet, mode="max-autotune", fullgraph=True, dynamic=False)
+            
+            # Compilation happens on the first call; pay for it here, with the
+            # same shape as the test, so the timed generation runs compiled
+            logger.info("🔧 Compiling UNet (warmup run)...")
+            with torch.inference_mode():
+                pipe(prompt="warmup", output_type="latent", **_TEST_GENERATION_ARGS)
+        else:
+            # Offloading manages device placement itself, so no .to("cuda") here
+            try:
+                from diffusers.hooks import apply_group_offloading
+            except ImportError:
+                # diffusers < 0.33 has no group offloading
+                apply_group_offloading = None
+            
+            if apply_group_offloading is not None:
+                # Block-level offload on a side CUDA stream: block N+1 is copied
+                # in while block N computes, hiding the PCIe transfers
+                for component in (pipe.unet, pipe.vae, pipe.text_encoder, pipe.text_encoder_2):
+                    apply_group_offloading(
+                        component,
+                        onload_device=torch.device("cuda"),
+                        offload_type="block_level",
+                        num_blocks_per_group=1,
+                        use_stream=True
+                    )
+            else:
+                pipe.enable_model_cpu_offload()
+    
+    return pipe
+
+
+def _get_pipe():
+    """Return the shared SDXL pipeline, loading it on first use"""
+    global _PIPE
+    if _PIPE is None:
+        with _PIPE_LOCK:
+            if _PIPE is None:
+                _PIPE = _load_pipe()
+    return _PIPE
+
+
+def _release_pipe():
+    """Drop the shared pipeline and hand its GPU memory back"""
+    global _PIPE
+    if _PIPE is not None:
+        _PIPE = None
+        if _gpu_info().available:
+            torch = _lazy("torch")
+            torch.cuda.empty_cache()
+
+
+atexit.register(_release_pipe)
+
+
+def main(save_image=True):
     logger.info("🎨 Testing SDXL Image Generation")
     logger.info("=" * 40)
     
-    # Check system
-    logger.info(f"CUDA available: {torch.cuda.is_available()}")
-    if torch.cuda.is_available():
-        logger.info(f"GPU: {torch.cuda.get_device_name()}")
-        logger.info(f"GPU memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.1f}GB")
-    
-    # Check config
+    # Check config first: a disabled setup shouldn't pay for importing torch
     logger.info(f"USE_LOCAL_MODELS: {USE_LOCAL_MODELS}")
     logger.info(f"IMAGE_MODEL: {IMAGE_GENERATION_MODEL}")
     logger.info(f"IMAGE_SIZE: {IMAGE_SIZE}")
@@ -45,36 +226,24 @@ def main():
         log_error("❌ Local models disabled. Set USE_LOCAL_MODELS=True in config")
         return
     
+    # Check system
+    try:
+        torch = _lazy("torch")
+        _lazy("diffusers")
+    except ImportError as e:
+        log_error(f"Import error: {e}")
+        log_error("Install required packages: pip install torch diffusers")
+        return False
+    
+    gpu = _gpu_info()
+    logger.info(f"CUDA available: {gpu.available}")
+    if gpu.available:
+        logger.info(f"GPU: {gpu.name} (SM{gpu.compute_capability[0]}{gpu.compute_capability[1]})")
+        logger.info(f"GPU memory: {gpu.total_memory_gb:.1f}GB")
+    
     try:
         logger.info("\n🔥 Loading SDXL pipeline...")
-        from diffusers import StableDiffusionXLPipeline
-        import os
-        
-        # Set environment variables for better download performance
-        os.environ["HF_HUB_ENABLE_HF_TRANSFER"] = "1"  # Use faster download client
-        
-        # Authentication is handled by the cached token from huggingface-cli login
-        logger.info("🔑 Using cached HuggingFace authentication...")
-        
-        # Load pipeline - using correct SDXL model name with better download settings
-        model_name = "stabilityai/stable-diffusion-xl-base-1.0"  # Correct model name
-        logger.info(f"Loading model: {model_name}")
-        
-        # Try with better download settings
-        pipe = StableDiffusionXLPipeline.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16,
-            use_safetensors=True,
-            variant="fp16",
-            resume_download=True,  # Resume interrupted downloads
-            local_files_only=False,  # Allow fresh downloads
-            force_download=False  # Don't re-download if already cached
-        )
-        
-        if torch.cuda.is_available():
-            pipe = pipe.to("cuda")
-            pipe.enable_attention_slicing()
-            pipe.enable_model_cpu_offload()
+        pipe = _get_pipe()
         
         logger.info("✅ SDXL pipeline loaded successfully!")
         
@@ -82,17 +251,26 @@ def main():
         test_prompt = "A friendly robot in a garden, digital art"
         logger.info(f"\n🎨 Generating test image with prompt: {test_prompt}")
         
-        image = pipe(
-            prompt=test_prompt,
-            width=512,
-            height=512,
-            num_inference_steps=20,  # Fast test
-            guidance_scale=7.5
-        ).images[0]
+        # inference_mode skips autograd bookkeeping entirely; a latency-only
+        # run stops at the latents and skips the VAE decode
+        start_time = time.perf_counter()
+        with torch.inference_mode():
+            output = pipe(
+                prompt=test_prompt,
+                output_type="pil" if save_image else "latent",
+                **_TEST_GENERATION_ARGS
+            )
+        logger.info(f"⏱️  Generation took {time.perf_counter() - start_time:.2f}s")
+        
+        if not save_image:
+            logger.info("✅ Test latents generated")
+            return True
         
         # Save image
+        image = output.images[0]
         output_path = os.path.join(OUTPUT_DIR, "test_robot.png")
-        image.save(output_path)
+        # Fast deflate: test output is looked at, not archived
+        image.save(output_path, format="PNG", compress_level=1, optimize=False)
         
         logger.info(f"✅ Test image generated: {output_path}")
         return True
@@ -101,9 +279,23 @@ def main():
         log_error(f"❌ Image generation failed: {e}")
         return False
 
-def test_image_generation():
+def test_image_generation(save_image=True):
     """Function to test image generation"""
-    return main()
+    return main(save_image=save_image)
 
 if __name__ == "__main__":
-    test_image_generation()
+    import argparse
+    parser = argparse.ArgumentParser(description="Test SDXL image generation")
+    parser.add_argument("--latent-only", action="store_true",
+                        help="Time generation only, skipping the VAE decode and the saved image")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log debug output (overrides QUIET)")
+    args = parser.parse_args()
+    
+    configure_logging()
+    # QUIET=1 trims the console output to warnings and errors
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif os.environ.get("QUIET"):
+        logging.getLogger().setLevel(logging.WARNING)
+    test_image_generation(save_image=not args.latent_only)
@@ -2,36 +2,59 @@
 Error handling utilities
 """
 
-import os
-import sys
+import queue
+import atexit
 import logging
-import traceback
+from logging.handlers import QueueHandler, QueueListener
+from types import MappingProxyType
 from datetime import datetime
 
-# Add parent directory to path for imports
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 from config import LOG_LEVEL, LOG_FILE
 
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL.upper()),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
+# Friendly messages for API status codes, built once
+_ERROR_MESSAGES = MappingProxyType({
+    400: "Bad Request - Check your input parameters",
+    401: "Unauthorized - Check your API token",
+    403: "Forbidden - API access denied",
+    404: "Not Found - Model or endpoint not available",
+    429: "Rate Limit Exceeded - Please wait and try again",
+    500: "Internal Server Error - Try again later",
+    503: "Service Unavailable - Model is loading or overloaded"
+})
+
+
+def configure_logging():
+    """Set up console and file logging; called by entry points, not at import"""
+    root_logger = logging.getLogger()
+    if root_logger.handlers:  # same no-op-if-configured rule as basicConfig
+        return
+    
+    # The console stays synchronous so messages print before an input()
+    # prompt; only the file writes go through a background thread
+    log_queue = queue.Queue(-1)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    
+    root_logger.setLevel(getattr(logging, LOG_LEVEL.upper()))
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.addHandler(console_handler)
+    listener.start()
+    # Drain whatever is still queued before the interpreter exits
+    atexit.register(listener.stop)
+
 
 def log_error(error_message: str, exception: Exception = None):
     """Log error with optional exception details"""
     if exception:
-        logger.error(f"{error_message}: {str(exception)}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        # One record; message and traceback are only formatted if it is emitted
+        logger.error("%s: %s", error_message, exception, exc_info=exception)
     else:
         logger.error(error_message)
 
@@ -48,17 +71,7 @@ def log_warning(message: str):
 
 def handle_api_error(response_code: int, response_text: str = "") -> str:
     """Handle API errors and return appropriate error message"""
-    error_messages = {
-        400: "Bad Request - Check your input parameters",
-        401: "Unauthorized - Check your API token",
-        403: "Forbidden - API access denied",
-        404: "Not Found - Model or endpoint not available",
-        429: "Rate Limit Exceeded - Please wait and try again",
-        500: "Internal Server Error - Try again later",
-        503: "Service Unavailable - Model is loading or overloaded"
-    }
-    
-    base_message = error_messages.get(response_code, f"HTTP Error {response_code}")
+    base_message = _ERROR_MESSAGES.get(response_code) or f"HTTP Error {response_code}"
     
     if response_text:
         return f"{base_message}: {response_text}"
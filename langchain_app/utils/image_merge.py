@@ -4,22 +4,27 @@ Handles background removal and character placement
 """
 
 import os
-import sys
+import re
+import atexit
+import asyncio
+import hashlib
+import random
+import threading
+import functools
+import importlib.util
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import logging
-from PIL import Image, ImageDraw
-from typing import Tuple, Optional
 from io import BytesIO
+from PIL import Image, ImageChops, ImageDraw
+from typing import List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
 
-# Add parent directory to path for imports
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-try:
-    from rembg import remove
-    REMBG_AVAILABLE = True
-except ImportError:
-    REMBG_AVAILABLE = False
+# rembg pulls in onnxruntime, so only check that it is installed here and
+# import it the first time a background actually has to be removed
+REMBG_AVAILABLE = importlib.util.find_spec("rembg") is not None
+if not REMBG_AVAILABLE:
     logger = logging.getLogger(__name__)
     logger.warning("rembg package not available. Falling back to basic background removal.")
 
@@ -29,167 +34,468 @@ from config import (
     IMAGE_GENERATION_MODEL,
     IMAGE_SIZE,
     BACKGROUND_REMOVE_THRESHOLD,
+    REMBG_MODEL,
+    USE_LEGACY_BG_REMOVE,
     API_TIMEOUT,
     MAX_RETRIES,
-    RATE_LIMIT_WAIT,
+    IMAGE_GENERATION_DEADLINE,
     OUTPUT_DIR,
     TEMP_DIR,
-    USE_LOCAL_MODELS
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_MAX_BYTES,
+    USE_LOCAL_MODELS,
+    USE_LCM
 )
-from utils.error_handler import log_error, log_info, log_warning, ImageProcessingError
+from utils.error_handler import log_error, log_info, log_warning, handle_api_error, ImageProcessingError
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
+# One keep-alive session for all Inference API calls so retries and the
+# character/background pair reuse the TCP+TLS connection
+_HTTP_SESSION = requests.Session()
+# Room for the concurrent character/background requests; retries are done
+# by _generate_image_api, not by urllib3
+_HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+if HUGGINGFACE_API_TOKEN:
+    _HTTP_SESSION.headers["Authorization"] = f"Bearer {HUGGINGFACE_API_TOKEN}"
+atexit.register(_HTTP_SESSION.close)
+
+# Per-channel lookup table for the fallback background removal: 255 where
+# a value is at or below the white threshold, 0 above it
+_WHITE_LUT = bytes(255 if v <= BACKGROUND_REMOVE_THRESHOLD else 0 for v in range(256))
+
+# Transient Inference API failures worth retrying: rate limits, overload,
+# model still loading
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 529})
+
+# Local sampling: DPM++ 2M Karras converges in ~20 steps; the LCM-LoRA in
+# ~6 without classifier-free guidance. Both feed the image cache key.
+if USE_LCM:
+    _LOCAL_SAMPLER, _LOCAL_STEPS, _LOCAL_GUIDANCE = "lcm", 6, 1.0
+else:
+    _LOCAL_SAMPLER, _LOCAL_STEPS, _LOCAL_GUIDANCE = "dpmpp_2m_karras", 20, 7.5
+_LCM_LORA = "latent-consistency/lcm-lora-sdxl"
+
+# The Inference API runs its own default scheduler
+_API_STEPS = 50
+
+# SDXL stays resident only on cards with room for a batched 1024x1024 run
+# (two prompts with guidance); smaller cards offload idle components
+_RESIDENT_MIN_VRAM_GB = 16
+
+# Loaded SDXL pipelines keyed by (model, device), reused across images
+_PIPE_CACHE: dict = {}
+_PIPE_LOCK = threading.Lock()
+
+# Anything outside [a-z0-9] is unsafe in output filenames
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+
+def _prompt_digest(prompt: str) -> bytes:
+    """Stable hash of everything that determines the generated image"""
+    if USE_LOCAL_MODELS:
+        backend = f"local|{_LOCAL_SAMPLER}|{_LOCAL_STEPS}|{_LOCAL_GUIDANCE}"
+    else:
+        backend = f"api|{_API_STEPS}"
+    key = f"{backend}|{IMAGE_GENERATION_MODEL}|{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}|{prompt}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+
+def _prompt_seed(prompt: str) -> int:
+    """Deterministic sampler seed for a prompt so identical prompts give identical images"""
+    # 31 bits keeps the seed valid for both torch.Generator and the Inference API
+    return int.from_bytes(_prompt_digest(prompt)[:4], "little") & 0x7FFFFFFF
+
+
+def _cache_path(prompt: str) -> str:
+    """Where the generated image for a prompt is kept between runs"""
+    return os.path.join(IMAGE_CACHE_DIR, f"{_prompt_digest(prompt).hex()}.png")
+
+
+def _load_cached_image(path: str) -> Optional[Image.Image]:
+    """Read a cached image, or None if it is missing or unreadable"""
+    try:
+        image = Image.open(path)
+        image.load()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        # A corrupt entry would fail every run; drop it so it gets regenerated
+        log_warning(f"Discarding unreadable cached image {path}: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    
+    # Eviction goes by mtime, so a hit marks the entry as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return image
+
+
+def _store_cached_image(image: Image.Image, path: str):
+    """Write an image into the cache so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        # Cheap deflate: the cache is for speed, not for archiving
+        image.save(tmp_path, format="PNG", compress_level=1)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log_warning(f"Could not cache generated image: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _evict_image_cache():
+    """Delete the least recently used cache files until the cache fits IMAGE_CACHE_MAX_BYTES"""
+    entries = []
+    total = 0
+    with os.scandir(IMAGE_CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    
+    if total <= IMAGE_CACHE_MAX_BYTES:
+        return
+    
+    # Oldest first; leftover .tmp files from crashed runs go early too
+    entries.sort()
+    for _, size, path in entries:
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    log_info(f"Image cache trimmed to {total / 1024 ** 2:.0f} MB")
+
 
 def generate_image_from_prompt(prompt: str, filename: str) -> str:
     """Generate image using local models or Hugging Face API"""
+    return generate_images_from_prompts([prompt], [filename])[0]
+
+
+def generate_images_from_prompts(prompts: List[str], filenames: List[str]) -> List[str]:
+    """Generate several images and save them to TEMP_DIR for callers that need paths"""
+    return [save_image(image, filename) for image, filename in zip(generate_images(prompts), filenames)]
+
+
+def save_image(image: Image.Image, filename: str) -> str:
+    """Write an in-memory image to TEMP_DIR and return its path"""
+    image_path = os.path.join(TEMP_DIR, filename)
+    image.save(image_path)
+    log_info(f"Image saved: {image_path}")
+    return image_path
+
+
+def generate_images(prompts: List[str]) -> List[Image.Image]:
+    """Generate images in memory, running the local model once for all cache misses"""
     try:
-        if USE_LOCAL_MODELS:
-            return _generate_image_local(prompt, filename)
-        else:
-            return _generate_image_api(prompt, filename)
+        images = [None] * len(prompts)
+        misses = []
+        
+        # Seeds are derived from the prompt, so a cached image is exactly what
+        # a fresh generation would produce
+        for i, prompt in enumerate(prompts):
+            image = _load_cached_image(_cache_path(prompt))
+            if image is not None:
+                log_info(f"Image cache hit for prompt: {prompt[:40]}...")
+                images[i] = image
+            else:
+                misses.append(i)
+        
+        if misses:
+            miss_prompts = [prompts[i] for i in misses]
+            if USE_LOCAL_MODELS:
+                generated = _generate_images_local_batch(miss_prompts)
+            else:
+                generated = _generate_images_api_concurrent(miss_prompts)
+            
+            for i, image in zip(misses, generated):
+                _store_cached_image(image, _cache_path(prompts[i]))
+                images[i] = image
+            
+            try:
+                _evict_image_cache()
+            except OSError as e:
+                log_warning(f"Image cache eviction failed: {e}")
+        
+        return images
         
     except Exception as e:
-        log_error(f"Error generating image {filename}", e)
+        log_error(f"Error generating {len(prompts)} image(s)", e)
         raise ImageProcessingError(f"Image generation failed: {e}")
 
 
-def _generate_image_local(prompt: str, filename: str) -> str:
-    """Generate image using local diffusion model"""
-    try:
-        from diffusers import StableDiffusionXLPipeline
-        import torch
-        
+def _get_local_pipeline(device: str):
+    """Return the SDXL pipeline for this device, loading it on first use"""
+    from diffusers import StableDiffusionXLPipeline
+    import torch
+    
+    key = (IMAGE_GENERATION_MODEL, device)
+    pipe = _PIPE_CACHE.get(key)
+    if pipe is None:
         logger.info(f"🎨 Loading local image model: {IMAGE_GENERATION_MODEL}")
         
-        # Check if CUDA is available
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {device}")
+        # bf16 on Ampere and newer (fp16's range overflows in places),
+        # fp16 on older GPUs, full precision on the CPU
+        if device == "cuda":
+            dtype = torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+        else:
+            dtype = torch.float32
         
         # Load the SDXL pipeline
         pipe = StableDiffusionXLPipeline.from_pretrained(
             IMAGE_GENERATION_MODEL,
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            torch_dtype=dtype,
             use_safetensors=True,
             variant="fp16" if device == "cuda" else None
         )
         
+        if USE_LCM:
+            from diffusers import LCMScheduler
+            pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config)
+            pipe.load_lora_weights(_LCM_LORA)
+            pipe.fuse_lora()
+        else:
+            from diffusers import DPMSolverMultistepScheduler
+            pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+                pipe.scheduler.config,
+                algorithm_type="dpmsolver++",
+                use_karras_sigmas=True
+            )
+        
         if device == "cuda":
-            pipe = pipe.to("cuda")
-            # Enable memory efficient attention
-            pipe.enable_attention_slicing()
-            pipe.enable_model_cpu_offload()
-        
-        # Generate image
-        image = pipe(
-            prompt=prompt,
-            width=IMAGE_SIZE[0],
-            height=IMAGE_SIZE[1],
-            num_inference_steps=30,  # Reduced for faster generation
-            guidance_scale=7.5,
-            num_images_per_prompt=1
-        ).images[0]
-        
-        # Save the image
-        image_path = os.path.join(TEMP_DIR, filename)
-        image.save(image_path)
-        
-        log_info(f"Local image saved: {image_path}")
-        return image_path
+            # Fused attention kernels are faster than slicing and need less
+            # memory; xformers if installed, PyTorch 2 SDPA otherwise
+            try:
+                pipe.enable_xformers_memory_efficient_attention()
+            except Exception:
+                from diffusers.models.attention_processor import AttnProcessor2_0
+                pipe.set_attn_processor(AttnProcessor2_0())
+            
+            vram_gb = torch.cuda.get_device_properties(0).total_memory / 1024 ** 3
+            if vram_gb < _RESIDENT_MIN_VRAM_GB:
+                # The weights alone fit on 8-12GB cards, but the activations of
+                # a batched run don't; keep only the active component on the GPU
+                log_info(f"{vram_gb:.0f}GB VRAM: using model CPU offload for SDXL")
+                pipe.enable_model_cpu_offload()
+                pipe.enable_vae_slicing()
+                _PIPE_CACHE[key] = pipe
+                return pipe
+            
+            # Stay resident so the cached pipeline is warm on the next call;
+            # offload only when the weights don't fit
+            try:
+                pipe = pipe.to("cuda")
+            except torch.cuda.OutOfMemoryError:
+                log_warning("Not enough VRAM to keep SDXL resident, using sequential CPU offload")
+                pipe = pipe.to("cpu")
+                torch.cuda.empty_cache()
+                pipe.enable_sequential_cpu_offload()
+            else:
+                # The first image pays the compile; every later one through
+                # the cached pipeline runs the fused kernels. No CUDA graphs
+                # ("reduce-overhead"): their state is per thread, and the
+                # pipeline is shared by worker threads and batch sizes vary
+                pipe.unet = torch.compile(pipe.unet, fullgraph=False)
+        
+        _PIPE_CACHE[key] = pipe
+    
+    return pipe
+
+
+def _run_local_pipeline(pipe, prompts: List[str]) -> List[Image.Image]:
+    """One diffusion run over the prompts, seeded per prompt"""
+    import torch
+    
+    return pipe(
+        prompt=prompts,
+        width=IMAGE_SIZE[0],
+        height=IMAGE_SIZE[1],
+        num_inference_steps=_LOCAL_STEPS,
+        guidance_scale=_LOCAL_GUIDANCE,
+        num_images_per_prompt=1,
+        # CPU generators keep the seeds reproducible on any device
+        generator=[torch.Generator(device="cpu").manual_seed(_prompt_seed(p)) for p in prompts]
+    ).images
+
+
+def _generate_images_local_batch(prompts: List[str]) -> List[Image.Image]:
+    """Generate images for several prompts in one batched diffusion run"""
+    try:
+        import torch
+        
+        # Check if CUDA is available
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        logger.info(f"Using device: {device}")
+        
+        # Pipelines keep per-call scheduler state, so one caller at a time
+        with _PIPE_LOCK:
+            pipe = _get_local_pipeline(device)
+            
+            # Generate all images in one batch; a generator per prompt gives
+            # each image the same starting noise as a single-prompt run
+            try:
+                images = _run_local_pipeline(pipe, prompts)
+            except torch.cuda.OutOfMemoryError:
+                if len(prompts) == 1:
+                    raise
+                log_warning("Not enough VRAM for a batched run, generating one image at a time")
+                torch.cuda.empty_cache()
+                images = [_run_local_pipeline(pipe, [prompt])[0] for prompt in prompts]
+        
+        log_info(f"Generated {len(images)} local image(s)")
+        return images
         
     except Exception as e:
-        log_error(f"Local image generation failed for {filename}", e)
+        log_error(f"Local image generation failed for {len(prompts)} prompt(s)", e)
         raise ImageProcessingError(f"Local image generation failed: {e}")
 
 
-def _generate_image_api(prompt: str, filename: str) -> str:
-    """Generate image using Hugging Face API"""
+def _generate_image_api(prompt: str, deadline: float = None) -> Image.Image:
+    """Generate image using Hugging Face API; gives up once the time.monotonic() deadline passes"""
     try:
         if not HUGGINGFACE_API_TOKEN:
             raise Exception("HUGGINGFACE_API_TOKEN not found in environment variables")
         
-        headers = {
-            "Authorization": f"Bearer {HUGGINGFACE_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "inputs": prompt,
             "parameters": {
                 "guidance_scale": 7.5,
-                "num_inference_steps": 50,
+                "num_inference_steps": _API_STEPS,
                 "width": IMAGE_SIZE[0],
-                "height": IMAGE_SIZE[1]
+                "height": IMAGE_SIZE[1],
+                "seed": _prompt_seed(prompt)
             }
         }
         
         url = f"{HUGGINGFACE_API_URL}/{IMAGE_GENERATION_MODEL}"
         
+        last_error = None
         for attempt in range(MAX_RETRIES):
+            wait_time = None
+            timeout = API_TIMEOUT
+            if deadline is not None:
+                timeout = min(API_TIMEOUT, deadline - time.monotonic())
+                if timeout <= 0:
+                    last_error = f"{IMAGE_GENERATION_DEADLINE}s deadline reached"
+                    break
             try:
-                log_info(f"Generating image (attempt {attempt + 1}): {filename}")
-                response = requests.post(url, headers=headers, json=payload, timeout=API_TIMEOUT)
+                log_info(f"Generating image (attempt {attempt + 1}): {prompt[:40]}...")
+                response = _HTTP_SESSION.post(url, json=payload, timeout=timeout)
+                if response.status_code == 200:
+                    image = Image.open(BytesIO(response.content))
+                    image.load()
+                    
+                    log_info("Image received from API")
+                    return image
+            except requests.RequestException as e:
+                last_error = e
+            else:
+                if response.status_code not in _RETRYABLE_STATUS:
+                    response.raise_for_status()
                 
+                last_error = handle_api_error(response.status_code)
                 if response.status_code == 503:
-                    # Model is loading
-                    estimated_time = 60  # Default wait time
+                    # Model is loading; poll again well before the (often
+                    # pessimistic) estimate runs out
+                    estimated_time = 60
                     try:
-                        error_data = response.json()
-                        estimated_time = error_data.get("estimated_time", 60)
-                    except:
+                        estimated_time = response.json().get("estimated_time", 60)
+                    except ValueError:
                         pass
-                    log_warning(f"Model is loading, waiting {estimated_time} seconds...")
-                    time.sleep(estimated_time)
-                    continue
-                    
-                elif response.status_code == 429:
-                    log_warning("Rate limit reached. Please wait and try again later.")
-                    raise Exception("Rate limit reached")
-                    
-                elif response.status_code == 200:
-                    # Save the image
-                    image_path = os.path.join(TEMP_DIR, filename)
-                    with open(image_path, "wb") as f:
-                        f.write(response.content)
-                    
-                    log_info(f"Image saved: {image_path}")
-                    return image_path
-                    
-                else:
-                    response.raise_for_status()
-                    
-            except requests.RequestException as e:
-                if attempt == MAX_RETRIES - 1:
-                    raise ImageProcessingError(f"Image generation failed after {MAX_RETRIES} attempts: {e}")
-                time.sleep(RATE_LIMIT_WAIT)
+                    wait_time = min(estimated_time, 30 + random.random() * 10)
+            
+            if attempt == MAX_RETRIES - 1:
+                break
+            
+            # Jittered, growing waits keep parallel requests from retrying in lockstep
+            if wait_time is None:
+                wait_time = random.uniform(2, 4) * (attempt + 1)
+            if deadline is not None and time.monotonic() + wait_time >= deadline:
+                log_warning(f"{last_error} - no time left before the deadline to retry")
+                break
+            log_warning(f"{last_error} - retrying in {wait_time:.1f} seconds...")
+            time.sleep(wait_time)
         
-        raise ImageProcessingError("Failed to generate image")
+        raise ImageProcessingError(f"Gave up on the Inference API: {last_error}")
         
     except Exception as e:
         raise ImageProcessingError(f"Image generation failed: {e}")
 
 
+@functools.lru_cache(maxsize=1)
+def _rembg_session():
+    """Load the rembg ONNX model once; every later cut-out reuses the session"""
+    import onnxruntime
+    from rembg import new_session
+    
+    # Run on the GPU when onnxruntime was built with CUDA support
+    providers = ["CPUExecutionProvider"]
+    if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+    
+    logger.info(f"Loading rembg model: {REMBG_MODEL}")
+    return new_session(REMBG_MODEL, providers=providers)
+
+
+def _generate_images_api_concurrent(prompts: List[str]) -> List[Image.Image]:
+    """Run the Inference API requests side by side; each one mostly waits on the network"""
+    # Workers stop retrying at the deadline, so none is left sleeping behind the CLI
+    deadline = time.monotonic() + IMAGE_GENERATION_DEADLINE
+    if len(prompts) == 1:
+        return [_generate_image_api(prompts[0], deadline)]
+    
+    pool = ThreadPoolExecutor(max_workers=len(prompts))
+    try:
+        futures = [pool.submit(_generate_image_api, p, deadline) for p in prompts]
+        
+        # Each request has its own API_TIMEOUT; this caps the batch as a whole
+        _, pending = wait(futures, timeout=IMAGE_GENERATION_DEADLINE)
+        if pending:
+            raise ImageProcessingError(f"Image generation exceeded {IMAGE_GENERATION_DEADLINE}s deadline")
+        
+        return [future.result() for future in futures]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _open_image(image_path: str) -> Image.Image:
+    """Open an image file; JPEGs larger than IMAGE_SIZE decode at a reduced DCT scale"""
+    image = Image.open(image_path)
+    # No-op for PNG and other formats without draft support
+    image.draft("RGB", IMAGE_SIZE)
+    return image
+
+
 def remove_background(image_path: str) -> Image.Image:
     """Remove background from character image using AI-powered rembg or fallback to color-based masking"""
+    return remove_background_from_image(_open_image(image_path))
+
+
+def remove_background_from_image(image: Image.Image) -> Image.Image:
+    """Remove background from an in-memory character image (rembg, or color-based fallback)"""
     try:
-        # Open the image
-        img = Image.open(image_path).convert("RGBA")
+        img = image.convert("RGBA")
         
-        if REMBG_AVAILABLE:
+        if REMBG_AVAILABLE and not USE_LEGACY_BG_REMOVE:
             # Use rembg for AI-powered background removal
             logger.info("Using rembg for AI-powered background removal")
+            from rembg import remove
             
-            # Convert PIL image to bytes
-            img_bytes = BytesIO()
-            img.save(img_bytes, format='PNG')
-            img_bytes.seek(0)
-            
-            # Remove background using rembg
-            output_bytes = remove(img_bytes.getvalue())
-            
-            # Convert back to PIL Image
-            result_img = Image.open(BytesIO(output_bytes)).convert("RGBA")
+            # rembg accepts PIL images directly, which skips a PNG
+            # encode/decode round-trip through an in-memory buffer
+            result_img = remove(img, session=_rembg_session()).convert("RGBA")
             
             log_info("Background removed successfully using rembg")
             return result_img
@@ -199,13 +505,12 @@ def remove_background(image_path: str) -> Image.Image:
             return _remove_white_background_fallback(img)
         
     except Exception as e:
-        log_error(f"Error removing background from {image_path}", e)
+        log_error("Error removing background", e)
         # If rembg fails, try fallback method
-        if REMBG_AVAILABLE:
+        if REMBG_AVAILABLE and not USE_LEGACY_BG_REMOVE:
             logger.warning("rembg failed, falling back to color-based removal")
             try:
-                img = Image.open(image_path).convert("RGBA")
-                return _remove_white_background_fallback(img)
+                return _remove_white_background_fallback(image.convert("RGBA"))
             except Exception as fallback_error:
                 log_error(f"Fallback background removal also failed", fallback_error)
                 raise ImageProcessingError(f"Background removal failed: {e}")
@@ -216,25 +521,17 @@ def remove_background(image_path: str) -> Image.Image:
 def _remove_white_background_fallback(img: Image.Image) -> Image.Image:
     """Fallback method: Remove white background using color-based masking"""
     try:
-        # Get image data
-        data = img.getdata()
-        
-        # Create new data with transparent background
-        new_data = []
-        for item in data:
-            # Check if pixel is close to white
-            r, g, b, a = item
-            if (r > BACKGROUND_REMOVE_THRESHOLD and 
-                g > BACKGROUND_REMOVE_THRESHOLD and 
-                b > BACKGROUND_REMOVE_THRESHOLD):
-                # Make pixel transparent
-                new_data.append((r, g, b, 0))
-            else:
-                # Keep pixel as is
-                new_data.append(item)
+        r, g, b, a = img.split()
+        
+        # A pixel stays visible if any channel is at or below the threshold,
+        # i.e. it is not close to white
+        mask = ImageChops.lighter(
+            ImageChops.lighter(r.point(_WHITE_LUT), g.point(_WHITE_LUT)),
+            b.point(_WHITE_LUT)
+        )
         
-        # Update image data
-        img.putdata(new_data)
+        # Make near-white pixels transparent, leaving the rest of the alpha as is
+        img.putalpha(ImageChops.multiply(a, mask))
         
         log_info("White background removed successfully using fallback method")
         return img
@@ -262,8 +559,9 @@ def resize_character_for_background(character_img: Image.Image, background_img:
         new_width = int(char_width * scale_factor)
         new_height = target_height
         
-        # Resize character
-        resized_character = character_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Resize character; reducing_gap box-reduces large downscales first so
+        # LANCZOS only runs over a smaller intermediate
+        resized_character = character_img.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0)
         
         log_info(f"Character resized from {char_width}x{char_height} to {new_width}x{new_height}")
         return resized_character
@@ -275,39 +573,49 @@ def resize_character_for_background(character_img: Image.Image, background_img:
 
 def merge_character_and_background(character_path: str, background_path: str, output_filename: str) -> str:
     """Merge character and background images"""
+    return merge_images(_open_image(character_path), _open_image(background_path), output_filename)
+
+
+def merge_images(character_image: Image.Image, background_image: Image.Image, output_filename: str) -> str:
+    """Merge in-memory character and background images; both are consumed"""
     try:
         log_info("Starting image merge process...")
         
-        # Open background image
-        background = Image.open(background_path).convert("RGBA")
+        background = background_image.convert("RGBA")
+        background_image.close()
         
         # Remove background from character using AI-powered rembg or fallback method
-        character = remove_background(character_path)
+        character = remove_background_from_image(character_image)
+        character_image.close()
         
         # Resize character to fit background
         character_resized = resize_character_for_background(character, background)
+        character.close()
+        del character
         
         # Calculate position to center character horizontally and place at bottom
         bg_width, bg_height = background.size
         char_width, char_height = character_resized.size
         
-        # Center horizontally, place near bottom (leaving some space)
-        x_position = (bg_width - char_width) // 2
-        y_position = bg_height - char_height - 20  # 20 pixels from bottom
-        
-        # Create a copy of background for merging
-        merged = background.copy()
+        # Center horizontally, place near bottom (leaving some space);
+        # alpha_composite only takes non-negative offsets
+        x_position = max(0, (bg_width - char_width) // 2)
+        y_position = max(0, bg_height - char_height - 20)  # 20 pixels from bottom
         
-        # Paste character onto background using alpha channel as mask
-        merged.paste(character_resized, (x_position, y_position), character_resized)
+        # Blend character onto background in one pass using its alpha channel;
+        # the background was opened here, so draw on it instead of a copy
+        background.alpha_composite(character_resized, (x_position, y_position))
+        character_resized.close()
         
-        # Convert back to RGB for final output
-        final_image = Image.new("RGB", merged.size, (255, 255, 255))
-        final_image.paste(merged, mask=merged.split()[-1])  # Use alpha channel as mask
-        
-        # Save the final merged image
+        # The generated background is opaque, so dropping alpha is all the
+        # RGB conversion needs
         output_path = os.path.join(OUTPUT_DIR, output_filename)
-        final_image.save(output_path, "JPEG", quality=95)
+        final_image = background.convert("RGB")
+        background.close()
+        # 4:2:0 chroma at q90 encodes faster and about a third the size of
+        # 4:4:4 at q95, with no visible difference on generated art
+        final_image.save(output_path, "JPEG", quality=90, subsampling=2, progressive=True)
+        final_image.close()
         
         log_info(f"Successfully merged images. Output saved to: {output_path}")
         return output_path
@@ -317,6 +625,12 @@ def merge_character_and_background(character_path: str, background_path: str, ou
         raise ImageProcessingError(f"Image merging failed: {e}")
 
 
+@functools.lru_cache(maxsize=128)
+def slugify_topic(topic: str, max_length: int = 64) -> str:
+    """Turn a story topic into a filesystem-safe title for output filenames"""
+    return _SLUG_RE.sub("_", topic.lower()).strip("_")[:max_length] or "story"
+
+
 def create_story_visualization(character_prompt: str, background_prompt: str, story_title: str = "story") -> str:
     """Complete pipeline to create story visualization"""
     try:
@@ -325,29 +639,45 @@ def create_story_visualization(character_prompt: str, background_prompt: str, st
         # Generate timestamp for unique filenames
         timestamp = int(time.time())
         
-        # Generate character image
-        character_filename = f"character_{timestamp}.png"
-        character_path = generate_image_from_prompt(character_prompt, character_filename)
-        
-        # Generate background image
-        background_filename = f"background_{timestamp}.png"
-        background_path = generate_image_from_prompt(background_prompt, background_filename)
+        # Generate character and background images (one batch on local
+        # models, concurrent requests on the API), kept in memory for the merge
+        character_image, background_image = generate_images([character_prompt, background_prompt])
         
         # Merge images
-        output_filename = f"{story_title}_{timestamp}_final.jpg"
-        final_image_path = merge_character_and_background(
-            character_path, 
-            background_path, 
-            output_filename
+        final_image_path = merge_images(
+            character_image,
+            background_image,
+            f"{story_title}_{timestamp}_final.jpg"
         )
         
-        # Clean up temporary files
-        try:
-            os.remove(character_path)
-            os.remove(background_path)
-            log_info("Temporary files cleaned up")
-        except:
-            pass  # Don't fail if cleanup doesn't work
+        log_info(f"Story visualization completed: {final_image_path}")
+        return final_image_path
+        
+    except Exception as e:
+        log_error("Error creating story visualization", e)
+        raise ImageProcessingError(f"Story visualization failed: {e}")
+
+
+async def acreate_story_visualization(character_prompt: str, background_prompt: str, story_title: str = "story") -> str:
+    """Async story visualization pipeline - generates character and background images concurrently"""
+    try:
+        log_info("Starting async story visualization creation...")
+        
+        # Generate timestamp for unique filenames
+        timestamp = int(time.time())
+        
+        # Blocking work (a batched diffusion run or concurrent HTTP calls), so
+        # keep it off the event loop
+        character_image, background_image = await asyncio.to_thread(
+            generate_images, [character_prompt, background_prompt]
+        )
+        
+        final_image_path = await asyncio.to_thread(
+            merge_images,
+            character_image,
+            background_image,
+            f"{story_title}_{timestamp}_final.jpg"
+        )
         
         log_info(f"Story visualization completed: {final_image_path}")
         return final_image_path
@@ -367,7 +697,7 @@ def test_image_generation():
         result = create_story_visualization(test_character_prompt, test_background_prompt, "test")
         logger.info(f"Test completed successfully! Output: {result}")
         
-        if REMBG_AVAILABLE:
+        if REMBG_AVAILABLE and not USE_LEGACY_BG_REMOVE:
             logger.info("Test used AI-powered background removal (rembg)")
         else:
             logger.info("Test used fallback color-based background removal")
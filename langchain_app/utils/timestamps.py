@@ -0,0 +1,20 @@
+"""
+Timestamp helpers for output filenames
+"""
+
+import time
+from datetime import datetime
+
+# Last (second, slug) pair - summaries written back-to-back share one strftime
+_last_slug = (None, "")
+
+
+def now_slug() -> str:
+    """Current local time as YYYYMMDD_HHMMSS, formatted at most once per second"""
+    global _last_slug
+    second = int(time.time())
+    cached_second, slug = _last_slug
+    if cached_second != second:
+        slug = datetime.fromtimestamp(second).strftime("%Y%m%d_%H%M%S")
+        _last_slug = (second, slug)
+    return slug